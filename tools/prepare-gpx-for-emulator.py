@@ -6,90 +6,148 @@ Thins out points and adds realistic timestamps so the emulator
 can play back the full route without stopping.
 """
 
-import xml.etree.ElementTree as ET
-import math
 import sys
+from array import array
+from itertools import accumulate, tee
+from math import sin, cos, sqrt, asin, radians, isnan, nan
 from datetime import datetime, timedelta
 
+try:
+    from lxml import etree as ET
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
+
 NS = "http://www.topografix.com/GPX/1/1"
-ET.register_namespace("", NS)
-ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+RTEPT_TAG = f"{{{NS}}}rtept"
+TRKPT_TAG = f"{{{NS}}}trkpt"
+ELE_TAG = f"{{{NS}}}ele"
+
+EARTH_RADIUS_M = 6371000
+
+def haversine_rad(rlat1, rlon1, cos_rlat1, rlat2, rlon2, cos_rlat2):
+    """Distance in meters between two GPS points given in radians.
+
+    Takes the cosine of each latitude precomputed so callers walking a
+    sequence of points only transform each point once.
+    """
+    a = (sin((rlat2 - rlat1) / 2) ** 2 +
+         cos_rlat1 * cos_rlat2 * sin((rlon2 - rlon1) / 2) ** 2)
+    return EARTH_RADIUS_M * 2 * asin(sqrt(min(1.0, a)))
 
 def haversine(lat1, lon1, lat2, lon2):
     """Distance in meters between two GPS points."""
-    R = 6371000
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = (math.sin(dlat / 2) ** 2 +
-         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
-         math.sin(dlon / 2) ** 2)
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    rlat1, rlat2 = radians(lat1), radians(lat2)
+    return haversine_rad(rlat1, radians(lon1), cos(rlat1),
+                         rlat2, radians(lon2), cos(rlat2))
+
+def segment_distances(lats, lons):
+    """Yield the distance in meters between each pair of consecutive points."""
+    if not lats:
+        return
+    prev_rlat, prev_rlon = radians(lats[0]), radians(lons[0])
+    prev_cos = cos(prev_rlat)
+    for i in range(1, len(lats)):
+        rlat, rlon = radians(lats[i]), radians(lons[i])
+        cos_rlat = cos(rlat)
+        yield haversine_rad(prev_rlat, prev_rlon, prev_cos,
+                            rlat, rlon, cos_rlat)
+        prev_rlat, prev_rlon, prev_cos = rlat, rlon, cos_rlat
+
+def iso_timestamps(start_time, offsets):
+    """Yield "YYYY-MM-DDTHH:MM:SSZ" for each offset in seconds from start_time.
+
+    Whole seconds are formatted with integer arithmetic; the date part is
+    only rebuilt when an offset crosses midnight.
+    """
+    start = start_time.hour * 3600 + start_time.minute * 60 + start_time.second
+    day, date_str = None, None
+    for offset in offsets:
+        # Round to microseconds first, as timedelta would, then truncate
+        day_offset, secs = divmod(start + int(round(offset, 6)), 86400)
+        if day_offset != day:
+            day = day_offset
+            date_str = (start_time.date() + timedelta(days=day)).isoformat()
+        hours, rem = divmod(secs, 3600)
+        minutes, seconds = divmod(rem, 60)
+        yield f"{date_str}T{hours:02d}:{minutes:02d}:{seconds:02d}Z"
+
+def read_points(input_path):
+    """Stream lat/lon/ele of every route point as parallel arrays.
+
+    Route points (rtept) are preferred; track points (trkpt) are used
+    only when the file has no route. Missing elevations are stored as
+    NaN so the arrays stay homogeneous.
+    """
+    columns = {
+        RTEPT_TAG: (array("d"), array("d"), array("d")),
+        TRKPT_TAG: (array("d"), array("d"), array("d")),
+    }
+    # lxml can filter by tag inside libxml2 and skip unrelated events
+    kwargs = {"tag": tuple(columns)} if HAVE_LXML else {}
+    for _, elem in ET.iterparse(input_path, events=("end",), **kwargs):
+        cols = columns.get(elem.tag)
+        if cols is None:
+            continue
+        lats, lons, eles = cols
+        lats.append(float(elem.get("lat")))
+        lons.append(float(elem.get("lon")))
+        ele_el = elem.find(ELE_TAG)
+        eles.append(float(ele_el.text) if ele_el is not None else nan)
+        elem.clear()
+        if HAVE_LXML:
+            # Also drop the emptied siblings still held by the parent
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    # Try track points if there is no route
+    return columns[RTEPT_TAG] if columns[RTEPT_TAG][0] else columns[TRKPT_TAG]
 
 def thin_and_timestamp(input_path, output_path, speed_mph=35, max_points=1000):
-    tree = ET.parse(input_path)
-    root = tree.getroot()
-
-    # Collect all route points
-    points = []
-    for rtept in root.iter(f"{{{NS}}}rtept"):
-        lat = float(rtept.get("lat"))
-        lon = float(rtept.get("lon"))
-        ele_el = rtept.find(f"{{{NS}}}ele")
-        ele = float(ele_el.text) if ele_el is not None else None
-        points.append((lat, lon, ele))
-
-    if not points:
-        # Try track points instead
-        for trkpt in root.iter(f"{{{NS}}}trkpt"):
-            lat = float(trkpt.get("lat"))
-            lon = float(trkpt.get("lon"))
-            ele_el = trkpt.find(f"{{{NS}}}ele")
-            ele = float(ele_el.text) if ele_el is not None else None
-            points.append((lat, lon, ele))
-
-    print(f"Original points: {len(points)}")
+    lats, lons, eles = read_points(input_path)
+
+    print(f"Original points: {len(lats)}")
 
     # Thin points: keep every Nth point
-    if len(points) > max_points:
-        step = len(points) // max_points
-        points = points[::step]
-    print(f"Thinned to: {len(points)}")
+    if len(lats) > max_points:
+        step = len(lats) // max_points
+        lats, lons, eles = lats[::step], lons[::step], eles[::step]
+    print(f"Thinned to: {len(lats)}")
 
     # Build new GPX with track (trk) instead of route — emulator prefers tracks
     speed_mps = speed_mph * 0.44704  # mph to m/s
     start_time = datetime(2025, 7, 26, 12, 0, 0)
 
-    gpx = ET.Element("gpx", {
-        "xmlns": NS,
-        "version": "1.1",
-        "creator": "CurveCall-Tools",
-    })
-
-    trk = ET.SubElement(gpx, "trk")
-    name = ET.SubElement(trk, "name")
-    name.text = "Smoky Mountain Loop (Emulator)"
-    trkseg = ET.SubElement(trk, "trkseg")
-
-    current_time = start_time
-    for i, (lat, lon, ele) in enumerate(points):
-        trkpt = ET.SubElement(trkseg, "trkpt", lat=f"{lat:.6f}", lon=f"{lon:.6f}")
-        if ele is not None:
-            ele_el = ET.SubElement(trkpt, "ele")
-            ele_el.text = f"{ele:.1f}"
-        time_el = ET.SubElement(trkpt, "time")
-        time_el.text = current_time.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-        # Calculate time to next point
-        if i < len(points) - 1:
-            dist = haversine(lat, lon, points[i + 1][0], points[i + 1][1])
-            dt = max(dist / speed_mps, 1.0)  # at least 1 second between points
-            current_time += timedelta(seconds=dt)
-
-    tree = ET.ElementTree(gpx)
-    ET.indent(tree, space="  ")
-    tree.write(output_path, xml_declaration=True, encoding="UTF-8")
-
-    total_minutes = (current_time - start_time).total_seconds() / 60
+    # Seconds from start at each point, at least 1 second between points.
+    # Distances, offsets and timestamps are all lazy, so the write loop
+    # below is the only pass over the thinned points.
+    offsets, timestamp_offsets = tee(accumulate(
+        (max(d / speed_mps, 1.0) for d in segment_distances(lats, lons)),
+        initial=0.0))
+    timestamps = iso_timestamps(start_time, timestamp_offsets)
+    offset = 0.0
+
+    # Stream points straight to the file rather than building a tree
+    with open(output_path, "w", encoding="UTF-8", newline="\n",
+              buffering=1 << 20) as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n"
+                f'<gpx xmlns="{NS}" version="1.1" creator="CurveCall-Tools">\n'
+                "  <trk>\n"
+                "    <name>Smoky Mountain Loop (Emulator)</name>\n"
+                "    <trkseg>\n")
+        for lat, lon, ele, offset, timestamp in zip(lats, lons, eles,
+                                                    offsets, timestamps):
+            f.write(f'      <trkpt lat="{lat:.6f}" lon="{lon:.6f}">\n')
+            if not isnan(ele):
+                f.write(f"        <ele>{ele:.1f}</ele>\n")
+            f.write(f"        <time>{timestamp}</time>\n"
+                    "      </trkpt>\n")
+        f.write("    </trkseg>\n"
+                "  </trk>\n"
+                "</gpx>")
+
+    total_minutes = offset / 60
     print(f"Output: {output_path}")
     print(f"Simulated drive time: {total_minutes:.0f} minutes at {speed_mph} mph")
 